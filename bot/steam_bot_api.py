@@ -1,20 +1,50 @@
-import datetime
+import asyncio
+import hashlib
+import heapq
 import logging
 import os
 import time
-from typing import Optional, Any, Dict, List
-
-import requests
+from collections import Counter
+from contextlib import aclosing
+from datetime import datetime, timezone
+from typing import Optional, Any, AsyncIterator, Dict, List
+from urllib.parse import quote
+
+import httpx
+import orjson
+from aiolimiter import AsyncLimiter
+from async_lru import alru_cache
+from cachetools import TTLCache
 from dotenv import load_dotenv
+from redis.asyncio import Redis
+from redis.exceptions import RedisError
 from telegram import Update
-from telegram.ext import Application, CommandHandler, MessageHandler, filters, ContextTypes
+from telegram.error import TelegramError
+from telegram.ext import AIORateLimiter, Application, CommandHandler, MessageHandler, filters, ContextTypes
 
 # === Настройка ===
 load_dotenv()
 
 TELEGRAM_BOT_TOKEN = os.getenv("TELEGRAM_BOT_TOKEN")
-OLLAMA_URL = "http://ollama:11434/api/chat"
+OLLAMA_BASE_URL = "http://ollama:11434"
 STEAM_API_KEY = os.getenv("STEAM_API_KEY")
+REDIS_URL = os.getenv("REDIS_URL", "redis://redis:6379/0")
+
+# Время жизни кэша ответов Steam, в секундах
+STEAM_CACHE_TTL = {"profile": 300, "friend_countries": 600, "games": 1800}
+# Копия на случай недоступности Steam
+STALE_CACHE_TTL = 7 * 24 * 3600
+# Ответы модели кэшируются по хэшу сводки профиля; смените версию, чтобы сбросить кэш после правки промпта
+PROMPT_VERSION = "v1"
+LLM_CACHE_TTL = 24 * 3600
+# Как часто обновлять сообщение с роастом во время генерации; Telegram не любит больше ~1 правки в секунду на чат
+LLM_EDIT_INTERVAL = 1.0
+# Steam отвечает 500 при слишком частых параллельных запросах с одного ключа
+FRIEND_BATCH_CONCURRENCY = 8
+# Сколько секунд помнить, что такого vanity-ника в Steam нет
+UNKNOWN_VANITY_TTL = 60
+# Ники могут освобождаться и переходить к другим аккаунтам, поэтому найденный SteamID64 тоже устаревает
+VANITY_CACHE_TTL = 3600
 
 logging.basicConfig(
     format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
@@ -23,139 +53,284 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 
+# === HTTP-клиенты ===
+
+CLIENT = httpx.AsyncClient(
+    base_url="https://api.steampowered.com",
+    transport=httpx.AsyncHTTPTransport(
+        http2=True,
+        # По HTTP/2 параллельные запросы мультиплексируются в одном соединении — много простаивающих не нужно
+        limits=httpx.Limits(max_connections=64, max_keepalive_connections=5),
+        retries=3,
+    ),
+    timeout=15.0,
+    headers={"Content-Type": "application/json", "Accept-Encoding": "gzip, br"},
+)
+
+OLLAMA_CLIENT = httpx.AsyncClient(
+    base_url=OLLAMA_BASE_URL,
+    # Ollama в той же docker-сети: сжатие только тратит CPU на распаковку
+    headers={"Content-Type": "application/json", "Accept-Encoding": "identity"},
+    limits=httpx.Limits(max_connections=10, max_keepalive_connections=10),
+    timeout=30.0,
+)
+
+REDIS = Redis.from_url(REDIS_URL)
+
+# Адреса Steam API с заранее закодированным ключом и постоянными параметрами;
+# при вызове к ним дописывается только значение последнего параметра
+_STEAM_KEY_QUERY = "key=" + quote(STEAM_API_KEY or "", safe="")
+_RESOLVE_VANITY_URL = f"/ISteamUser/ResolveVanityURL/v0001/?{_STEAM_KEY_QUERY}&vanityurl="
+_PLAYER_SUMMARIES_URL = f"/ISteamUser/GetPlayerSummaries/v0002/?{_STEAM_KEY_QUERY}&steamids="
+_FRIEND_LIST_URL = f"/ISteamUser/GetFriendList/v0001/?{_STEAM_KEY_QUERY}&relationship=friend&steamid="
+_OWNED_GAMES_URL = (
+    f"/IPlayerService/GetOwnedGames/v0001/?{_STEAM_KEY_QUERY}"
+    "&include_appinfo=1&include_played_free_games=1&steamid="
+)
+
+# Steam допускает не больше ~100 запросов в секунду с одного ключа
+STEAM_LIMITER = AsyncLimiter(max_rate=100, time_period=1)
+# Не больше 64 одновременных запросов к Steam на весь бот
+STEAM_SEMAPHORE = asyncio.Semaphore(64)
+STEAM_RETRY_STATUSES = {429, 500, 502, 503, 504}
+STEAM_MAX_RETRIES = 3
+STEAM_MAX_RETRY_DELAY = 10.0
+
+# Загрузки профилей в процессе, по SteamID64: повторные запросы того же профиля ждут уже запущенную задачу
+_INFLIGHT_PROFILES: Dict[str, asyncio.Task] = {}
+
+# Ники, которые Steam не смог разрешить; успешные ответы кэширует alru_cache на _resolve_vanity
+_UNKNOWN_VANITY: TTLCache = TTLCache(maxsize=4096, ttl=UNKNOWN_VANITY_TTL)
+
+
 # === Вспомогательные функции ===
 
-def resolve_steam_id(user_input: str) -> Optional[str]:
+def _retry_delay(resp: httpx.Response, attempt: int) -> float:
+    """Пауза перед повтором: Retry-After от Steam, иначе экспоненциальная."""
+    retry_after = resp.headers.get("Retry-After", "")
+    if retry_after.isdigit():
+        return min(float(retry_after), STEAM_MAX_RETRY_DELAY)
+    return 2 ** attempt * 0.1
+
+
+async def _steam_get(path: str, **kwargs) -> httpx.Response:
+    attempt = 0
+    while True:
+        async with STEAM_SEMAPHORE, STEAM_LIMITER:
+            resp = await CLIENT.get(path, **kwargs)
+        if resp.status_code not in STEAM_RETRY_STATUSES or attempt >= STEAM_MAX_RETRIES:
+            return resp
+        await asyncio.sleep(_retry_delay(resp, attempt))
+        attempt += 1
+
+
+async def resolve_steam_id(user_input: str) -> Optional[str]:
     """Преобразует SteamID64, vanity URL или кастомный ник в SteamID64."""
     user_input = user_input.strip()
     if user_input.isdigit() and len(user_input) >= 15:
         return user_input
 
+    if user_input in _UNKNOWN_VANITY:
+        return None
+
     # Попытка разрешить как vanity URL
-    url = "https://api.steampowered.com/ISteamUser/ResolveVanityURL/v0001/"
     try:
-        resp = requests.get(url, params={"key": STEAM_API_KEY, "vanityurl": user_input}, timeout=10)
-        resp.raise_for_status()
-        data = resp.json()
-        if data["response"]["success"] == 1:
-            return data["response"]["steamid"]
+        return await _resolve_vanity(user_input)
+    except UnknownVanity:
+        _UNKNOWN_VANITY[user_input] = True
     except Exception as e:
         logger.error(f"Ошибка при разрешении vanity URL '{user_input}': {e}")
     return None
 
 
-def fetch_steam_profile(steam_id: str) -> Optional[Dict[str, Any]]:
-    """Получает полные данные профиля, друзей и игр."""
-    base_url = "https://api.steampowered.com"
-    headers = {"Content-Type": "application/json"}
-
-    # --- Профиль ---
-    profile_resp = requests.get(
-        f"{base_url}/ISteamUser/GetPlayerSummaries/v0002/",
-        params={"key": STEAM_API_KEY, "steamids": steam_id},
-        headers=headers,
-        timeout=10,
-    )
-    if profile_resp.status_code != 200:
+class UnknownVanity(Exception):
+    """Steam ответил, что такого vanity-ника нет."""
+
+
+@alru_cache(maxsize=4096, ttl=VANITY_CACHE_TTL)
+async def _resolve_vanity(vanity: str) -> str:
+    """Разрешает vanity URL через Steam; исключения (в т.ч. UnknownVanity) не кэшируются."""
+    resp = await _steam_get(_RESOLVE_VANITY_URL + quote(vanity, safe=""), timeout=10)
+    resp.raise_for_status()
+    data = orjson.loads(resp.content)
+    if data["response"]["success"] != 1:
+        raise UnknownVanity(vanity)
+    return data["response"]["steamid"]
+
+
+def _steam_ok(resp: httpx.Response) -> bool:
+    """True для успешного ответа, False для 401/403 (данные скрыты настройками приватности).
+
+    Остальные ошибки (429, 5xx) бросают httpx.HTTPStatusError, чтобы они не попали в кэш.
+    """
+    if resp.status_code in (401, 403):
+        return False
+    resp.raise_for_status()
+    return True
+
+
+async def _fetch_player(steam_id: str) -> Optional[Dict[str, Any]]:
+    """Получает сводку профиля одного пользователя."""
+    resp = await _steam_get(_PLAYER_SUMMARIES_URL + quote(steam_id, safe=""), timeout=10)
+    if not _steam_ok(resp):
         return None
-    players = profile_resp.json().get("response", {}).get("players", [])
-    if not players:
+    players = orjson.loads(resp.content).get("response", {}).get("players", [])
+    return players[0] if players else None
+
+
+async def _fetch_friend_countries(steam_id: str) -> Counter:
+    """Считает страны друзей; пачки по 100 ID запрашиваются параллельно и сразу сворачиваются в счётчик.
+
+    Ошибка любой пачки роняет весь подсчёт, чтобы неполное число друзей не попало в кэш.
+    """
+    countries = Counter()
+    friends_resp = await _steam_get(_FRIEND_LIST_URL + quote(steam_id, safe=""))
+    if _steam_ok(friends_resp):
+        friends = orjson.loads(friends_resp.content).get("friendslist", {}).get("friends", [])
+        friend_ids = [f["steamid"] for f in friends]
+        batches = [",".join(friend_ids[i:i + 100]) for i in range(0, len(friend_ids), 100)]
+        batch_limit = asyncio.Semaphore(FRIEND_BATCH_CONCURRENCY)
+
+        async def count_batch(batch: str) -> Counter:
+            async with batch_limit:
+                profiles_resp = await _steam_get(_PLAYER_SUMMARIES_URL + batch)
+            profiles_resp.raise_for_status()
+            batch_profiles = orjson.loads(profiles_resp.content).get("response", {}).get("players", [])
+            return Counter(p.get("loccountrycode", "??") for p in batch_profiles)
+
+        # TaskGroup отменяет оставшиеся пачки, как только одна из них упала
+        async with asyncio.TaskGroup() as tg:
+            tasks = [tg.create_task(count_batch(b)) for b in batches]
+        # Сливаем в порядке пачек, а не завершения запросов: от порядка вставки зависит
+        # разрешение ничьих в most_common, а значит и текст сводки с ключом кэша LLM
+        for task in tasks:
+            countries.update(task.result())
+    return countries
+
+
+async def _fetch_owned_games(steam_id: str) -> List[Dict[str, Any]]:
+    """Получает 10 игр с наибольшим наигранным временем."""
+    owned_games = []
+    games_resp = await _steam_get(_OWNED_GAMES_URL + quote(steam_id, safe=""))
+    if _steam_ok(games_resp):
+        all_games = orjson.loads(games_resp.content).get("response", {}).get("games", [])
+        owned_games = heapq.nlargest(10, all_games, key=lambda g: g.get("playtime_forever", 0))
+    return owned_games
+
+
+async def _cache_get(key: str) -> Optional[bytes]:
+    try:
+        return await REDIS.get(key)
+    except RedisError as e:
+        logger.warning(f"Redis недоступен ({key}): {e}")
         return None
-    user_data = players[0]
 
-    # --- Друзья ---
-    friends_list = []
+
+async def _cache_set(key: str, value: bytes, ttl: int):
     try:
-        friends_resp = requests.get(
-            f"{base_url}/ISteamUser/GetFriendList/v0001/",
-            params={"key": STEAM_API_KEY, "steamid": steam_id, "relationship": "friend"},
-            headers=headers,
-            timeout=15,
-        )
-        if friends_resp.status_code == 200:
-            friends = friends_resp.json().get("friendslist", {}).get("friends", [])
-            friend_ids = [f["steamid"] for f in friends]
-            if friend_ids:
-                for i in range(0, len(friend_ids), 100):
-                    batch = ",".join(friend_ids[i:i + 100])
-                    profiles_resp = requests.get(
-                        f"{base_url}/ISteamUser/GetPlayerSummaries/v0002/",
-                        params={"key": STEAM_API_KEY, "steamids": batch},
-                        headers=headers,
-                        timeout=15,
-                    )
-                    if profiles_resp.status_code == 200:
-                        batch_profiles = profiles_resp.json().get("response", {}).get("players", [])
-                        friends_list.extend(batch_profiles)
-    except Exception as e:
-        logger.warning(f"Ошибка загрузки друзей: {e}")
+        await REDIS.set(key, value, ex=ttl)
+    except RedisError as e:
+        logger.warning(f"Redis недоступен ({key}): {e}")
+
+
+async def _cached_steam_call(kind: str, steam_id: str, fetch, default):
+    """Возвращает (данные, устарели ли они), читая Redis перед запросом к Steam.
+
+    При ошибке Steam отдаёт последнюю сохранённую копию вместо пустого результата.
+    В кэш пишется только результат полностью успешного запроса: ошибки fetch бросает.
+    """
+    key = f"steam:{kind}:{steam_id}"
+    cached = await _cache_get(key)
+    if cached is not None:
+        return orjson.loads(cached), False
 
-    # --- Игры ---
-    owned_games = []
     try:
-        games_resp = requests.get(
-            f"{base_url}/IPlayerService/GetOwnedGames/v0001/",
-            params={
-                "key": STEAM_API_KEY,
-                "steamid": steam_id,
-                "include_appinfo": 1,
-                "include_played_free_games": 1,
-            },
-            headers=headers,
-            timeout=15,
-        )
-        if games_resp.status_code == 200:
-            all_games = games_resp.json().get("response", {}).get("games", [])
-            sorted_games = sorted(all_games, key=lambda g: g.get("playtime_forever", 0), reverse=True)
-            owned_games = sorted_games[:10]
+        value = await fetch(steam_id)
     except Exception as e:
-        logger.warning(f"Ошибка загрузки игр: {e}")
+        logger.warning(f"Ошибка загрузки {key}: {e}")
+        stale = await _cache_get(f"{key}:stale")
+        if stale is not None:
+            return orjson.loads(stale), True
+        return default, False
+
+    if value is not None:
+        blob = orjson.dumps(value)
+        await _cache_set(key, blob, STEAM_CACHE_TTL[kind])
+        await _cache_set(f"{key}:stale", blob, STALE_CACHE_TTL)
+    return value, False
+
+
+async def fetch_steam_profile(steam_id: str) -> Optional[Dict[str, Any]]:
+    """Получает полные данные профиля, друзей и игр."""
+    task = _INFLIGHT_PROFILES.get(steam_id)
+    if task is None:
+        task = asyncio.create_task(_load_steam_profile(steam_id))
+        _INFLIGHT_PROFILES[steam_id] = task
+        task.add_done_callback(lambda _: _INFLIGHT_PROFILES.pop(steam_id, None))
+    # shield: отмена одного ожидающего не должна отменять общую загрузку для остальных
+    return await asyncio.shield(task)
+
+
+async def _load_steam_profile(steam_id: str) -> Optional[Dict[str, Any]]:
+    profile, friends, games = await asyncio.gather(
+        _cached_steam_call("profile", steam_id, _fetch_player, None),
+        _cached_steam_call("friend_countries", steam_id, _fetch_friend_countries, {}),
+        _cached_steam_call("games", steam_id, _fetch_owned_games, []),
+    )
+    (user_data, profile_stale), (friend_countries, friends_stale), (owned_games, games_stale) = profile, friends, games
+    if not user_data:
+        return None
 
     return {
         "profile": user_data,
-        "friends": friends_list,
+        "friends_count": sum(friend_countries.values()),
+        "friend_countries": Counter(friend_countries),
         "owned_games_sample": owned_games,
+        "stale": profile_stale or friends_stale or games_stale,
     }
 
 
 def simplify_steam_profile(data: Dict[str, Any]) -> str:
     profile = data["profile"]
-    friends = data["friends"]
+    friends_count = data["friends_count"]
+    friend_countries = data["friend_countries"]
     games = data["owned_games_sample"]
 
     name = profile.get("realname") or "Not specified"
     persona = profile.get("personaname") or "No nickname"
     country = profile.get("loccountrycode") or "Unknown"
     created = profile.get("timecreated")
-    created_str = datetime.datetime.utcfromtimestamp(created).strftime("%m/%d/%Y") if created else "Unknown"
+    created_str = datetime.fromtimestamp(created, tz=timezone.utc).strftime("%m/%d/%Y") if created else "Unknown"
 
-    friend_countries = {}
-    for f in friends:
-        c = f.get("loccountrycode", "??")
-        friend_countries[c] = friend_countries.get(c, 0) + 1
-    top_countries = ", ".join(f"{cnt} from {c}" for c, cnt in sorted(friend_countries.items(), key=lambda x: -x[1])[:5])
+    top_countries = ", ".join(f"{cnt} from {c}" for c, cnt in friend_countries.most_common(5))
 
     total_playtime = sum(g.get("playtime_forever", 0) for g in games) / 60
-    game_titles = ", ".join(g["name"] for g in games[:10])
+    # owned_games_sample уже ограничен 10 играми в _fetch_owned_games
+    game_titles = ", ".join(g["name"] for g in games)
 
-    return f"""Steam User:
-- Display name: {persona}
-- Real name: {name}
-- Country: {country}
-- Account created: {created_str}
+    return "\n".join([
+        "Steam User:",
+        f"- Display name: {persona}",
+        f"- Real name: {name}",
+        f"- Country: {country}",
+        f"- Account created: {created_str}",
+        "",
+        "Friends:",
+        f"- Total friends: {friends_count}",
+        f"- Top friend countries: {top_countries}",
+        "",
+        "Gaming activity:",
+        f"- Sample of owned games: {len(games)}",
+        f"- Total playtime (in sample): ~{total_playtime:.1f} hours",
+        f"- Example games: {game_titles}",
+    ])
 
-Friends:
-- Total friends: {len(friends)}
-- Top friend countries: {top_countries}
 
-Gaming activity:
-- Sample of owned games: {len(games)}
-- Total playtime (in sample): ~{total_playtime:.1f} hours
-- Example games: {game_titles}"""
+# === Промпт ===
 
+LLM_MODEL = "phi3:mini"
 
-async def llm_message(message: str) -> str:
-    prompt = f"""You're a cheeky, sarcastic gamer from a chaotic Telegram group—think meme lord with a heart of gold-plated snark. Playfully roast this Steam user like you're teasing your weird-but-lovable roommate.
+_PROMPT_PREFIX = """You're a cheeky, sarcastic gamer from a chaotic Telegram group—think meme lord with a heart of gold-plated snark. Playfully roast this Steam user like you're teasing your weird-but-lovable roommate.
 
     Rules:
     - EXACTLY 2 sentences.
@@ -167,22 +342,53 @@ async def llm_message(message: str) -> str:
 
     Steam profile summary:
     Напиши на русском языке
-    {message}
     """
+_PROMPT_SUFFIX = "\n    "
+
+# Тело запроса к /api/chat сериализуется один раз; при вызове в него вклеивается только сводка профиля
+_CHAT_PAYLOAD_HEAD, _CHAT_PAYLOAD_TAIL = orjson.dumps({
+    "model": LLM_MODEL,
+    "messages": [{"role": "user", "content": _PROMPT_PREFIX + "\x00" + _PROMPT_SUFFIX}],
+    "stream": True,
+}).split(b"\\u0000")
+
+
+def _chat_payload(message: str) -> bytes:
+    return _CHAT_PAYLOAD_HEAD + orjson.dumps(message)[1:-1] + _CHAT_PAYLOAD_TAIL
+
+
+async def llm_message(message: str) -> AsyncIterator[str]:
+    """Стримит ответ модели по кускам по мере генерации."""
+    key = f"llm:{PROMPT_VERSION}:" + hashlib.blake2b(message.encode(), digest_size=16).hexdigest()
+    cached = await _cache_get(key)
+    if cached is not None:
+        yield cached.decode()
+        return
+
+    parts = []
+    done = False
     try:
-        payload = {
-            "model": "phi3:mini",
-            "messages": [{"role": "user", "content": prompt}],
-            "stream": False,
-        }
-        resp = requests.post(OLLAMA_URL, json=payload, timeout=30)
-        resp.raise_for_status()
-        answer = resp.json()["message"]["content"]
+        async with OLLAMA_CLIENT.stream("POST", "/api/chat", content=_chat_payload(message)) as resp:
+            resp.raise_for_status()
+            async for line in resp.aiter_lines():
+                if not line:
+                    continue
+                chunk = orjson.loads(line)
+                if "error" in chunk:
+                    raise RuntimeError(chunk["error"])
+                piece = chunk.get("message", {}).get("content", "")
+                if piece:
+                    parts.append(piece)
+                    yield piece
+                done = done or chunk.get("done", False)
+        # Кэшируем только полный непустой ответ, иначе пустой роаст залип бы на сутки
+        if parts and done:
+            await _cache_set(key, "".join(parts).encode(), LLM_CACHE_TTL)
     except Exception as e:
         logger.error(f"Ошибка ИИ: {e}")
-        answer = "Sorry, I'm having trouble thinking right now. 😕"
-
-    return f"{answer}\n\n{message}"
+    # И при ошибке, и при пустом ответе модели пользователь должен получить хоть что-то
+    if not parts:
+        yield "Sorry, I'm having trouble thinking right now. 😕"
 
 
 # === Обработчики Telegram ===
@@ -205,14 +411,14 @@ async def handle_steam_id(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if text.startswith("http"):
         if "/id/" in text:
             vanity = text.split("/id/")[-1].split("/")[0]
-            steam_id = resolve_steam_id(vanity)
+            steam_id = await resolve_steam_id(vanity)
         elif "/profiles/" in text:
             steam_id = text.split("/profiles/")[-1].split("/")[0]
         else:
             await update.message.reply_text("❌ Неверный формат ссылки.")
             return
     else:
-        steam_id = resolve_steam_id(text)
+        steam_id = await resolve_steam_id(text)
 
     if not steam_id:
         await update.message.reply_text(
@@ -220,7 +426,7 @@ async def handle_steam_id(update: Update, context: ContextTypes.DEFAULT_TYPE):
         )
         return
 
-    profile_data = fetch_steam_profile(steam_id)
+    profile_data = await fetch_steam_profile(steam_id)
     if not profile_data:
         await update.message.reply_text("❌ Не удалось получить данные. Профиль приватный или не существует.")
         return
@@ -237,6 +443,8 @@ async def handle_steam_id(update: Update, context: ContextTypes.DEFAULT_TYPE):
         f"👁️ <b>Видимость:</b> {visibility}\n"
         f"🔗 <a href='{p.get('profileurl', '')}'>Открыть профиль</a>"
     )
+    if profile_data["stale"]:
+        caption += "\n⚠️ Steam недоступен, показаны сохранённые данные."
 
     avatar = p.get("avatarfull")
     if avatar:
@@ -246,32 +454,50 @@ async def handle_steam_id(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
     # Отправка анализа + LLM-роаст
     simplified = simplify_steam_profile(profile_data)
-    roast = await llm_message(simplified)
-    await update.message.reply_text(roast)
+    sent = await update.message.reply_text("🤔 Думаю...")
+    roast = ""
+    shown = ""
+    last_edit = time.monotonic()
+    async with aclosing(llm_message(simplified)) as pieces:
+        async for piece in pieces:
+            roast += piece
+            if roast.strip() and roast != shown and time.monotonic() - last_edit >= LLM_EDIT_INTERVAL:
+                # Промежуточные правки необязательны: финальная всё равно отправит весь текст
+                try:
+                    await sent.edit_text(roast)
+                    shown = roast
+                except TelegramError as e:
+                    logger.warning(f"Не удалось обновить сообщение: {e}")
+                last_edit = time.monotonic()
+    await sent.edit_text(f"{roast}\n\n{simplified}")
 
 
 # === Инициализация ===
 
-def wait_for_ollama(url: str, timeout: int = 60):
+async def wait_for_ollama(timeout: int = 60):
     start = time.time()
+    attempt = 0
     while time.time() - start < timeout:
         try:
-            resp = requests.get(f"{url}/api/tags", timeout=5)
+            resp = await OLLAMA_CLIENT.head("/", timeout=5)
             if resp.status_code == 200:
                 logger.info("✅ Ollama is ready!")
                 return True
+            # Сервер уже принимает соединения — дальше опрашиваем часто
+            attempt = 0
         except Exception:
             logger.info("⏳ Waiting for Ollama...")
-            time.sleep(3)
+        await asyncio.sleep(min(0.1 * 2 ** attempt, 5.0))
+        attempt += 1
     raise TimeoutError("Ollama did not start in time")
 
 
-def load_model_if_needed(model_name: str = "phi3:mini"):
+async def load_model_if_needed(model_name: str = LLM_MODEL):
     try:
-        resp = requests.get("http://ollama:11434/api/tags", timeout=10)
+        resp = await OLLAMA_CLIENT.get("/api/tags", timeout=10)
         if resp.status_code == 200:
-            models = resp.json().get("models", [])
-            if any(model_name == m["name"] for m in models):
+            models = orjson.loads(resp.content).get("models", [])
+            if model_name in frozenset(m["name"] for m in models):
                 logger.info(f"✅ Модель {model_name} уже загружена.")
                 return
     except Exception as e:
@@ -279,21 +505,36 @@ def load_model_if_needed(model_name: str = "phi3:mini"):
 
     logger.info(f"📥 Загружаем модель: {model_name}...")
     try:
-        resp = requests.post("http://ollama:11434/api/pull", json={"name": model_name}, stream=True, timeout=600)
-        resp.raise_for_status()
-        for _ in resp.iter_lines():
-            pass
+        async with OLLAMA_CLIENT.stream("POST", "/api/pull", content=orjson.dumps({"name": model_name}), timeout=600) as resp:
+            resp.raise_for_status()
+            async for _ in resp.aiter_raw(1 << 16):
+                pass
         logger.info(f"✅ Модель {model_name} успешно загружена!")
     except Exception as e:
         logger.error(f"❌ Ошибка загрузки модели {model_name}: {e}")
         raise
 
 
-def main():
-    wait_for_ollama("http://ollama:11434", timeout=120)
-    load_model_if_needed("phi3:mini")
+async def post_init(app: Application):
+    await wait_for_ollama(timeout=120)
+    await load_model_if_needed(LLM_MODEL)
+
 
-    app = Application.builder().token(TELEGRAM_BOT_TOKEN).build()
+async def post_shutdown(app: Application):
+    await CLIENT.aclose()
+    await OLLAMA_CLIENT.aclose()
+    await REDIS.aclose()
+
+
+def main():
+    app = (
+        Application.builder()
+        .token(TELEGRAM_BOT_TOKEN)
+        .rate_limiter(AIORateLimiter(overall_max_rate=25, group_max_rate=18))
+        .post_init(post_init)
+        .post_shutdown(post_shutdown)
+        .build()
+    )
     app.add_handler(CommandHandler("start", start))
     app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_steam_id))
 
@@ -302,4 +543,4 @@ def main():
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()